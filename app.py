@@ -1,5 +1,13 @@
+import hashlib
 import os
+import time
+from functools import lru_cache
+import numpy as np
 import pandas as pd
+try:
+    from numba import njit
+except ImportError:  # Numba es opcional; se usa la versión con NumPy
+    njit = None
 from sqlalchemy import create_engine
 import dash
 import dash_bootstrap_components as dbc
@@ -7,34 +15,109 @@ from dash import dcc, html
 import plotly.graph_objects as go
 from dash.dependencies import Input, Output
 from dotenv import load_dotenv
+from flask_caching import Cache
+from flask_compress import Compress
 
 # Cargar variables de entorno
 load_dotenv()
 
+# Columnas usadas como filtros
+COLUMNAS_FILTRO = ('ciudad', 'aliado', 'región')
+
+# Caché local de los datos en parquet (desactivada si CACHE_TTL_SECS es 0).
+# Las rutas por defecto son relativas a la carpeta de la app, no al cwd
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_PATH = os.getenv('CACHE_PATH', os.path.join(BASE_DIR, 'cache.parquet'))
+CACHE_TTL_SECS = int(os.getenv('CACHE_TTL_SECS', '0'))
+
+def leer_cache():
+    if CACHE_TTL_SECS <= 0 or not os.path.exists(CACHE_PATH):
+        return None
+    if time.time() - os.path.getmtime(CACHE_PATH) >= CACHE_TTL_SECS:
+        return None
+    try:
+        return pd.read_parquet(CACHE_PATH)
+    except Exception as err:
+        print(f"Error al leer la caché: {err}")
+        return None
+
+def guardar_cache(df):
+    if CACHE_TTL_SECS <= 0:
+        return
+    # Escribir en un archivo temporal y reemplazar de forma atómica para que
+    # otros workers nunca lean un parquet a medio escribir
+    temporal = f"{CACHE_PATH}.{os.getpid()}.tmp"
+    try:
+        df.to_parquet(temporal)
+        os.replace(temporal, CACHE_PATH)
+    except Exception as err:
+        print(f"Error al guardar la caché: {err}")
+        if os.path.exists(temporal):
+            os.remove(temporal)
+
+def obtener_database_url():
+    # Obtener configuración de la base de datos
+    DATABASE_URL = os.environ.get('DATABASE_URL')
+    
+    # Si no hay DATABASE_URL, usar configuración local
+    if not DATABASE_URL:
+        # Verificar si estamos en Render (tiene variable RENDER)
+        if os.environ.get('RENDER'):
+            raise ValueError("Se requiere DATABASE_URL en entorno de producción")
+            
+        # Configuración local
+        DB_USER = os.getenv('DB_USER', 'root')
+        DB_PASSWORD = os.getenv('DB_PASSWORD', '123456')
+        DB_HOST = os.getenv('DB_HOST', 'localhost')
+        DB_NAME = os.getenv('DB_NAME', 'mi_base_de_datos')
+        DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}"
+    
+    # Ajustar para PostgreSQL si es necesario
+    if DATABASE_URL.startswith("postgres://"):
+        DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
+    
+    return DATABASE_URL
+
+@lru_cache(maxsize=None)
+def obtener_engine():
+    # Un único engine por proceso para reutilizar las conexiones
+    return create_engine(
+        obtener_database_url(),
+        pool_size=5,
+        pool_pre_ping=True
+    )
+
+def preparar_datos(df):
+    # Filtros como categóricas ordenadas (categorías ya ordenadas alfabéticamente)
+    for col in COLUMNAS_FILTRO:
+        categorias = sorted(df[col].dropna().unique())
+        df[col] = pd.Categorical(df[col], categories=categorias, ordered=True)
+    
+    # Reducir el tamaño de las columnas numéricas (solo si no hay negativos)
+    df['total_po'] = pd.to_numeric(df['total_po'], downcast='unsigned')
+    df['analisis'] = pd.to_numeric(df['analisis'], downcast='unsigned')
+    
+    df['porcentaje'] = (df['analisis'].sum() / df['total_po'].sum()) * 100
+    return df
+
 def cargar_datos():
+    # Evitar la consulta SQL si la caché local sigue vigente
+    df = leer_cache()
+    if df is not None:
+        return df
+    
     try:
-        # Obtener configuración de la base de datos
-        DATABASE_URL = os.environ.get('DATABASE_URL')
-        
-        # Si no hay DATABASE_URL, usar configuración local
-        if not DATABASE_URL:
-            # Verificar si estamos en Render (tiene variable RENDER)
-            if os.environ.get('RENDER'):
-                raise ValueError("Se requiere DATABASE_URL en entorno de producción")
-                
-            # Configuración local
-            DB_USER = os.getenv('DB_USER', 'root')
-            DB_PASSWORD = os.getenv('DB_PASSWORD', '123456')
-            DB_HOST = os.getenv('DB_HOST', 'localhost')
-            DB_NAME = os.getenv('DB_NAME', 'mi_base_de_datos')
-            DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}"
-        
-        # Ajustar para PostgreSQL si es necesario
-        if DATABASE_URL.startswith("postgres://"):
-            DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
-        
-        engine = create_engine(DATABASE_URL)
-        df = pd.read_sql_query("SELECT * FROM mi_tabla", engine)
+        # Agregar en la base de datos: el dashboard solo necesita sumas por
+        # combinación de región, ciudad y aliado
+        with obtener_engine().connect().execution_options(stream_results=True) as conn:
+            chunks = pd.read_sql_query(
+                "SELECT región, ciudad, aliado, "
+                "SUM(analisis) AS analisis, SUM(total_po) AS total_po "
+                "FROM mi_tabla GROUP BY región, ciudad, aliado",
+                conn,
+                chunksize=100_000
+            )
+            df = pd.concat(chunks, ignore_index=True, copy=False)
         
         # Verificar columnas necesarias
         required_columns = {'analisis', 'total_po', 'ciudad', 'aliado', 'región'}
@@ -44,8 +127,9 @@ def cargar_datos():
         
         # Limpieza de datos
         df.columns = df.columns.str.lower().str.strip()
-        df['porcentaje'] = (df['analisis'].sum() / df['total_po'].sum()) * 100
+        df = preparar_datos(df)
         
+        guardar_cache(df)
         return df
         
     except Exception as err:
@@ -59,8 +143,7 @@ def cargar_datos():
             'aliado': ['Aliado A', 'Aliado B', 'Aliado C'],
             'región': ['Centro', 'Antioquia', 'Valle']
         }
-        df_backup = pd.DataFrame(sample_data)
-        df_backup['porcentaje'] = (df_backup['analisis'].sum() / df_backup['total_po'].sum()) * 100
+        df_backup = preparar_datos(pd.DataFrame(sample_data))
         
         print("Usando datos de ejemplo generados")
         return df_backup
@@ -68,12 +151,81 @@ def cargar_datos():
 # Cargar datos
 df = cargar_datos()
 
+# Datos en formato columnar (dict de arreglos NumPy): los callbacks trabajan
+# solo con estos arreglos. Las columnas de filtro se guardan como códigos de
+# categoría y los valores con el dtype reducido en la carga; los kernels
+# acumulan en 64 bits.
+CATEGORIAS = {col: df[col].cat.categories.to_numpy() for col in COLUMNAS_FILTRO}
+POSICIONES = {col: {cat: i for i, cat in enumerate(CATEGORIAS[col])} for col in COLUMNAS_FILTRO}
+DATOS = {col: df[col].cat.codes.to_numpy() for col in COLUMNAS_FILTRO}
+DATOS['total_po'] = df['total_po'].to_numpy()
+DATOS['analisis'] = df['analisis'].to_numpy()
+
+# Opciones para los dropdowns (los datos no cambian después de la carga,
+# así que se fijan en el layout y no viajan en cada callback)
+CIUDADES_OPTIONS = tuple({'label': c, 'value': c} for c in CATEGORIAS['ciudad'])
+ALIADOS_OPTIONS = tuple({'label': a, 'value': a} for a in CATEGORIAS['aliado'])
+REGIONES_OPTIONS = tuple({'label': r, 'value': r} for r in CATEGORIAS['región'])
+
+# Totales sin filtros (vista inicial del dashboard)
+TOTAL_PO_ALL = np.nansum(DATOS['total_po'])
+ANALISIS_ALL = np.nansum(DATOS['analisis'])
+
+# Sumas precalculadas por cada filtro individual: matrices (filtro x grupo)
+# de sumas de analisis y número de filas, en el orden de las categorías.
+# Cuando filtro y grupo coinciden basta con los totales por filtro, así que
+# esa matriz diagonal no se guarda
+def tabla_precalculada(filtro, grupo):
+    agregado = df.groupby([filtro, grupo], observed=False)['analisis'].agg(['sum', 'size'])
+    forma = (len(CATEGORIAS[filtro]), len(CATEGORIAS[grupo]))
+    return (agregado['sum'].to_numpy().reshape(forma),
+            agregado['size'].to_numpy().reshape(forma))
+
+def totales_por_filtro(filtro):
+    agrupado = df.groupby(filtro, observed=False)
+    return {
+        'total_po': agrupado['total_po'].sum().to_numpy(),
+        'analisis': agrupado['analisis'].sum().to_numpy(),
+        'filas': agrupado.size().to_numpy(),
+    }
+
+PRECOMP = {
+    (filtro, grupo): tabla_precalculada(filtro, grupo)
+    for filtro in COLUMNAS_FILTRO
+    for grupo in ('ciudad', 'aliado')
+    if filtro != grupo
+}
+TOTALES_POR_FILTRO = {filtro: totales_por_filtro(filtro) for filtro in COLUMNAS_FILTRO}
+
 # Inicializar app Dash
 app = dash.Dash(__name__, 
                external_stylesheets=[dbc.themes.SOLAR],
                assets_folder='assets')  # Asegura que la carpeta assets sea encontrada
 server = app.server  # Necesario para Render
 
+# Comprimir las respuestas (las figuras viajan como JSON en cada callback)
+server.config.update(
+    COMPRESS_MIMETYPES=['application/json', 'text/html'],
+    COMPRESS_LEVEL=6
+)
+Compress(server)
+
+# Huella de los datos cargados: los workers con los mismos datos comparten
+# resultados y los de cargas anteriores dejan de coincidir (sin vaciar el backend)
+VERSION_DATOS = hashlib.sha1(
+    pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes()
+).hexdigest()[:16]
+
+# Caché de resultados del callback (SimpleCache por defecto; configurable
+# con CACHE_TYPE, p. ej. FileSystemCache o RedisCache para compartir entre workers)
+cache = Cache(server, config={
+    'CACHE_TYPE': os.getenv('CACHE_TYPE', 'SimpleCache'),
+    'CACHE_DEFAULT_TIMEOUT': int(os.getenv('CACHE_DEFAULT_TIMEOUT', '300')),
+    'CACHE_DIR': os.getenv('CACHE_DIR', os.path.join(BASE_DIR, 'flask_cache')),
+    'CACHE_REDIS_URL': os.getenv('CACHE_REDIS_URL', os.getenv('REDIS_URL', '')),
+    'CACHE_KEY_PREFIX': f"dashboard_{VERSION_DATOS}_",
+})
+
 # =============================================
 # Diseño de la aplicación
 # =============================================
@@ -112,6 +264,7 @@ app.layout = dbc.Container([
             html.Label("Ciudad:", style={'font-weight': 'bold', 'color': 'white'}),
             dcc.Dropdown(
                 id='filtro-ciudad',
+                options=CIUDADES_OPTIONS,
                 multi=True,
                 placeholder="Seleccione una ciudad",
                 style={'color': '#333'}  # Mejor contraste para el texto
@@ -120,6 +273,7 @@ app.layout = dbc.Container([
             html.Label("Aliado:", style={'font-weight': 'bold', 'color': 'white', 'margin-top': '10px'}),
             dcc.Dropdown(
                 id='filtro-aliado',
+                options=ALIADOS_OPTIONS,
                 multi=True,
                 placeholder="Seleccione un aliado",
                 style={'color': '#333'}
@@ -128,6 +282,7 @@ app.layout = dbc.Container([
             html.Label("Región:", style={'font-weight': 'bold', 'color': 'white', 'margin-top': '10px'}),
             dcc.Dropdown(
                 id='filtro-region',
+                options=REGIONES_OPTIONS,
                 multi=True,
                 placeholder="Seleccione una región",
                 style={'color': '#333'}
@@ -154,148 +309,336 @@ app.layout = dbc.Container([
 # =============================================
 # Callbacks para interactividad
 # =============================================
+def normalizar_filtros(ciudad, aliado, region):
+    # Ordenar los filtros para que combinaciones repetidas usen la caché
+    return (
+        tuple(sorted(ciudad or ())),
+        tuple(sorted(aliado or ())),
+        tuple(sorted(region or ()))
+    )
+
+@cache.memoize()
+def calcular_agregados(ciudad, aliado, region):
+    # Compartido por todos los callbacks: filtra y agrega una sola vez por
+    # combinación de filtros
+    filtros_activos = [(col, valores) for col, valores in
+                       (('región', region), ('ciudad', ciudad), ('aliado', aliado))
+                       if valores]
+    
+    if len(filtros_activos) == 1:
+        # Un solo filtro: consultar las tablas precalculadas
+        filtro, valores = filtros_activos[0]
+        posiciones = posiciones_seleccionadas(filtro, valores)
+        total_po = TOTALES_POR_FILTRO[filtro]['total_po'][posiciones].sum()
+        analisis = TOTALES_POR_FILTRO[filtro]['analisis'][posiciones].sum()
+        por_ciudad = consultar_precalculado(filtro, 'ciudad', posiciones)
+        por_aliado = consultar_precalculado(filtro, 'aliado', posiciones)
+    elif filtros_activos:
+        # Varios filtros: una sola pasada filtra y agrega todo
+        total_po, analisis, por_ciudad, por_aliado = filtrar_y_agregar(filtros_activos)
+    else:
+        total_po = TOTAL_PO_ALL
+        analisis = ANALISIS_ALL
+        por_ciudad = sumar_por_grupo('ciudad')
+        por_aliado = sumar_por_grupo('aliado')
+    
+    return total_po, analisis, por_ciudad, por_aliado
+
 @app.callback(
     [Output('resultado-porcentaje', 'children'),
      Output('publico-objetivo', 'children'),
-     Output('cargas-presenze', 'children'),
-     Output('grafico-barras', 'figure'),
-     Output('grafico-lineas', 'figure'),
-     Output('grafico-barras-aliados', 'figure'),
-     Output('filtro-ciudad', 'options'),
-     Output('filtro-aliado', 'options'),
-     Output('filtro-region', 'options')],
+     Output('cargas-presenze', 'children')],
     [Input('filtro-ciudad', 'value'),
      Input('filtro-aliado', 'value'),
      Input('filtro-region', 'value')]
 )
-def actualizar_dashboard(ciudad, aliado, region):
+def actualizar_tarjetas(ciudad, aliado, region):
     try:
-        # Aplicar filtros
-        df_filtrado = df.copy()
-        if region:
-            df_filtrado = df_filtrado[df_filtrado['región'].isin(region)]
-        if ciudad:
-            df_filtrado = df_filtrado[df_filtrado['ciudad'].isin(ciudad)]
-        if aliado:
-            df_filtrado = df_filtrado[df_filtrado['aliado'].isin(aliado)]
-        
-        # Calcular métricas
-        total_po = df_filtrado['total_po'].sum()
-        analisis = df_filtrado['analisis'].sum()
+        total_po, analisis, _, _ = calcular_agregados(*normalizar_filtros(ciudad, aliado, region))
         
         porcentaje = (analisis / total_po * 100) if total_po > 0 else 0
         publico_objetivo = total_po
         cargas_presenze = analisis
         
-        # Gráfico de barras por ciudad
-        fig_barras = crear_grafico_barras(df_filtrado)
+        return f"{porcentaje:.1f}%", f"{publico_objetivo:,}", f"{cargas_presenze:,}"
         
+    except Exception as e:
+        print(f"Error en callback: {e}")
+        # Retornar valores por defecto en caso de error
+        return "0%", "0", "0"
+
+@app.callback(
+    Output('grafico-barras', 'figure'),
+    [Input('filtro-ciudad', 'value'),
+     Input('filtro-aliado', 'value'),
+     Input('filtro-region', 'value')]
+)
+def actualizar_grafico_barras(ciudad, aliado, region):
+    try:
+        # Gráfico de barras por ciudad
+        _, _, por_ciudad, _ = calcular_agregados(*normalizar_filtros(ciudad, aliado, region))
+        return crear_grafico_barras(*por_ciudad)
+    except Exception as e:
+        print(f"Error en callback: {e}")
+        return go.Figure()
+
+@app.callback(
+    Output('grafico-lineas', 'figure'),
+    [Input('filtro-ciudad', 'value'),
+     Input('filtro-aliado', 'value'),
+     Input('filtro-region', 'value')]
+)
+def actualizar_grafico_lineas(ciudad, aliado, region):
+    try:
         # Gráfico de líneas por aliado
-        fig_lineas = crear_grafico_lineas(df_filtrado)
-        
+        _, _, _, por_aliado = calcular_agregados(*normalizar_filtros(ciudad, aliado, region))
+        return crear_grafico_lineas(*por_aliado)
+    except Exception as e:
+        print(f"Error en callback: {e}")
+        return go.Figure()
+
+@app.callback(
+    Output('grafico-barras-aliados', 'figure'),
+    [Input('filtro-ciudad', 'value'),
+     Input('filtro-aliado', 'value'),
+     Input('filtro-region', 'value')]
+)
+def actualizar_grafico_porcentaje(ciudad, aliado, region):
+    try:
         # Gráfico de porcentaje por aliado
-        fig_barras_aliados = crear_grafico_porcentaje(df_filtrado)
-        
-        # Opciones para los dropdowns
-        ciudades_options = [{'label': c, 'value': c} for c in sorted(df['ciudad'].unique())]
-        aliados_options = [{'label': a, 'value': a} for a in sorted(df['aliado'].unique())]
-        regiones_options = [{'label': r, 'value': r} for r in sorted(df['región'].unique())]
-        
-        return (
-            f"{porcentaje:.1f}%", 
-            f"{publico_objetivo:,}", 
-            f"{cargas_presenze:,}", 
-            fig_barras, 
-            fig_lineas, 
-            fig_barras_aliados,
-            ciudades_options, 
-            aliados_options, 
-            regiones_options
-        )
-        
+        _, _, _, por_aliado = calcular_agregados(*normalizar_filtros(ciudad, aliado, region))
+        return crear_grafico_porcentaje(*por_aliado)
     except Exception as e:
         print(f"Error en callback: {e}")
-        # Retornar valores por defecto en caso de error
-        return ("0%", "0", "0", go.Figure(), go.Figure(), go.Figure(), [], [], [])
+        return go.Figure()
 
 # =============================================
 # Funciones auxiliares para gráficos
 # =============================================
-def crear_grafico_barras(df):
-    df_barras = df.groupby('ciudad', as_index=False)['analisis'].sum()
+def sumar_por_codigo_reduceat(codigos, valores, sumas, conteos):
+    # Ordenar por código y sumar cada tramo contiguo con np.add.reduceat
+    validos = codigos >= 0
+    codigos = codigos[validos]
+    # La fila cuenta aunque analisis sea nulo; el nulo solo no suma
+    valores = valores[validos]
+    valores = np.where(valores == valores, valores, 0)
     
-    fig = go.Figure(go.Bar(
-        x=df_barras['analisis'], 
-        y=df_barras['ciudad'], 
-        orientation='h',
-        text=df_barras['analisis'], 
-        textposition='outside', 
-        marker_color='#1f77b4'
-    ))
+    if codigos.size:
+        orden = np.argsort(codigos, kind='stable')
+        codigos_ordenados = codigos[orden]
+        unicos, inicios = np.unique(codigos_ordenados, return_index=True)
+        sumas[unicos] += np.add.reduceat(valores[orden], inicios, dtype=sumas.dtype)
+        conteos[unicos] += np.diff(np.append(inicios, codigos_ordenados.size))
+    return sumas, conteos
+
+def filtrar_y_agregar_numpy(cod_region, cod_ciudad, cod_aliado,
+                            perm_region, perm_ciudad, perm_aliado, total_po, analisis,
+                            sumas_ciudad, conteos_ciudad, sumas_aliado, conteos_aliado):
+    # Los códigos -1 (nulos) indexan la última posición de cada tabla de permitidos
+    mask = perm_region[cod_region] & perm_ciudad[cod_ciudad] & perm_aliado[cod_aliado]
+    analisis_f = analisis[mask]
+    sumar_por_codigo(cod_ciudad[mask], analisis_f, sumas_ciudad, conteos_ciudad)
+    sumar_por_codigo(cod_aliado[mask], analisis_f, sumas_aliado, conteos_aliado)
+    return (np.nansum(total_po[mask]), np.nansum(analisis_f),
+            sumas_ciudad, conteos_ciudad, sumas_aliado, conteos_aliado)
+
+if njit is not None:
+    @njit(cache=True)
+    def sumar_por_codigo(codigos, valores, sumas, conteos):
+        # Suma y cuenta filas por código de categoría en una sola pasada
+        for i in range(codigos.size):
+            c = codigos[i]
+            if c >= 0:
+                # La fila cuenta aunque analisis sea nulo; el nulo solo no suma
+                v = valores[i]
+                if v == v:
+                    sumas[c] += v
+                conteos[c] += 1
+        return sumas, conteos
     
-    fig.update_layout(
-        title="Análisis por Ciudad",
-        xaxis_title="Cantidad",
-        yaxis_title="",
-        plot_bgcolor='rgba(0,0,0,0)',
-        paper_bgcolor='rgba(0,0,0,0)',
-        font=dict(color='white'),
-        margin=dict(l=20, r=20, b=50, t=50),
+    @njit(cache=True)
+    def filtrar_y_agregar_codigos(cod_region, cod_ciudad, cod_aliado,
+                                  perm_region, perm_ciudad, perm_aliado, total_po, analisis,
+                                  sumas_ciudad, conteos_ciudad, sumas_aliado, conteos_aliado):
+        # Una sola pasada: filtra con las tablas de permitidos y acumula los
+        # totales (escalares de 64 bits) y las sumas por grupo. Es secuencial:
+        # la entrada es la tabla agregada por región/ciudad/aliado, y los
+        # callbacks concurrentes no comparten un pool de hilos de Numba
+        suma_po = 0
+        suma_analisis = 0
+        for i in range(cod_ciudad.size):
+            # Los códigos -1 (nulos) indexan la última posición de permitidos
+            if not (perm_region[cod_region[i]] and perm_ciudad[cod_ciudad[i]]
+                    and perm_aliado[cod_aliado[i]]):
+                continue
+            p = total_po[i]
+            if p == p:
+                suma_po += p
+            # La fila cuenta aunque analisis sea nulo; el nulo solo no suma
+            v = analisis[i]
+            if v != v:
+                v = 0
+            suma_analisis += v
+            c = cod_ciudad[i]
+            if c >= 0:
+                sumas_ciudad[c] += v
+                conteos_ciudad[c] += 1
+            a = cod_aliado[i]
+            if a >= 0:
+                sumas_aliado[a] += v
+                conteos_aliado[a] += 1
+        return suma_po, suma_analisis, sumas_ciudad, conteos_ciudad, sumas_aliado, conteos_aliado
+else:
+    sumar_por_codigo = sumar_por_codigo_reduceat
+    filtrar_y_agregar_codigos = filtrar_y_agregar_numpy
+
+def armar_grupo(col, sumas, conteos):
+    # Etiquetas y sumas de los grupos con filas, igual que groupby(observed=True)
+    presentes = conteos > 0
+    return CATEGORIAS[col][presentes], sumas[presentes]
+
+def acumuladores(n, valores):
+    # Sumas en 64 bits (enteras o reales según los valores, aunque la columna
+    # esté reducida) y conteos de filas por código
+    tipo = np.int64 if valores.dtype.kind in 'iub' else np.float64
+    return np.zeros(n, tipo), np.zeros(n, np.int64)
+
+def sumar_por_grupo(col):
+    n = len(CATEGORIAS[col])
+    sumas, conteos = sumar_por_codigo(DATOS[col], DATOS['analisis'],
+                                      *acumuladores(n, DATOS['analisis']))
+    return armar_grupo(col, sumas, conteos)
+
+def posiciones_seleccionadas(col, valores):
+    # Códigos de los valores elegidos (se ignoran los que no existen)
+    return np.array([POSICIONES[col][v] for v in valores if v in POSICIONES[col]],
+                    dtype=np.intp)
+
+def tabla_permitidos(col, valores):
+    # Tabla booleana por código; la posición extra (código -1, nulos) solo
+    # se permite cuando el filtro no está activo
+    n = len(CATEGORIAS[col])
+    if not valores:
+        return np.ones(n + 1, dtype=np.bool_)
+    permitidos = np.zeros(n + 1, dtype=np.bool_)
+    permitidos[posiciones_seleccionadas(col, valores)] = True
+    return permitidos
+
+def filtrar_y_agregar(filtros_activos):
+    seleccion = dict(filtros_activos)
+    total_po, analisis, sumas_ciudad, conteos_ciudad, sumas_aliado, conteos_aliado = \
+        filtrar_y_agregar_codigos(
+            DATOS['región'],
+            DATOS['ciudad'],
+            DATOS['aliado'],
+            tabla_permitidos('región', seleccion.get('región')),
+            tabla_permitidos('ciudad', seleccion.get('ciudad')),
+            tabla_permitidos('aliado', seleccion.get('aliado')),
+            DATOS['total_po'],
+            DATOS['analisis'],
+            *acumuladores(len(CATEGORIAS['ciudad']), DATOS['analisis']),
+            *acumuladores(len(CATEGORIAS['aliado']), DATOS['analisis'])
+        )
+    return (total_po, analisis,
+            armar_grupo('ciudad', sumas_ciudad, conteos_ciudad),
+            armar_grupo('aliado', sumas_aliado, conteos_aliado))
+
+def consultar_precalculado(filtro, grupo, posiciones):
+    if filtro == grupo:
+        # Los totales por filtro ya son las sumas por grupo (solo los que tienen filas)
+        totales = TOTALES_POR_FILTRO[filtro]
+        presentes = np.sort(posiciones[totales['filas'][posiciones] > 0])
+        return CATEGORIAS[grupo][presentes], totales['analisis'][presentes]
+    
+    # Sumar las filas de la tabla precalculada que corresponden al filtro
+    sumas, conteos = PRECOMP[(filtro, grupo)]
+    return armar_grupo(grupo, sumas[posiciones].sum(axis=0), conteos[posiciones].sum(axis=0))
+
+# Compilar (o cargar de la caché de Numba) los kernels al importar, para que
+# ninguna petición de usuario pague la compilación
+if njit is not None:
+    sumar_por_grupo('ciudad')
+    sumar_por_grupo('aliado')  # Sus códigos pueden tener otro dtype
+    filtrar_y_agregar([])
+
+# Plantillas de las figuras como dicts de Plotly (Dash las acepta sin
+# construir ni validar objetos go.Figure en cada callback)
+LAYOUT_BASE = {
+    'plot_bgcolor': 'rgba(0,0,0,0)',
+    'paper_bgcolor': 'rgba(0,0,0,0)',
+    'font': {'color': 'white'},
+}
+
+FIG_BARRAS = {
+    'data': [{
+        'type': 'bar',
+        'orientation': 'h',
+        'textposition': 'outside',
+        'marker': {'color': '#1f77b4'}
+    }],
+    'layout': dict(
+        LAYOUT_BASE,
+        title={'text': "Análisis por Ciudad"},
+        xaxis={'title': {'text': "Cantidad"}},
+        yaxis={'title': {'text': ""}},
+        margin={'l': 20, 'r': 20, 'b': 50, 't': 50},
         height=400
     )
-    
-    return fig
+}
 
-def crear_grafico_lineas(df):
-    df_lineas = df.groupby('aliado', as_index=False)['analisis'].sum()
-    
-    fig = go.Figure(go.Scatter(
-        x=df_lineas['aliado'], 
-        y=df_lineas['analisis'], 
-        mode='lines+markers',
-        line=dict(color='#ff7f0e', width=3),
-        marker=dict(size=10, color='#ff7f0e')
-    ))
-    
-    fig.update_layout(
-        title="Análisis por Aliado",
-        xaxis_title="Aliado",
-        yaxis_title="Cantidad",
-        plot_bgcolor='rgba(0,0,0,0)',
-        paper_bgcolor='rgba(0,0,0,0)',
-        font=dict(color='white'),
-        margin=dict(l=20, r=20, b=50, t=50),
+FIG_LINEAS = {
+    'data': [{
+        'type': 'scatter',
+        'mode': 'lines+markers',
+        'line': {'color': '#ff7f0e', 'width': 3},
+        'marker': {'size': 10, 'color': '#ff7f0e'}
+    }],
+    'layout': dict(
+        LAYOUT_BASE,
+        title={'text': "Análisis por Aliado"},
+        xaxis={'title': {'text': "Aliado"}},
+        yaxis={'title': {'text': "Cantidad"}},
+        margin={'l': 20, 'r': 20, 'b': 50, 't': 50},
         height=400
     )
-    
-    return fig
+}
 
-def crear_grafico_porcentaje(df):
-    df_porcentaje = df.groupby('aliado', as_index=False)['analisis'].sum()
-    total = df_porcentaje['analisis'].sum()
-    df_porcentaje['porcentaje'] = (df_porcentaje['analisis'] / total * 100) if total > 0 else 0
-    
-    fig = go.Figure(go.Bar(
-        x=df_porcentaje['aliado'],
-        y=df_porcentaje['porcentaje'],
-        text=df_porcentaje['porcentaje'].round(1).astype(str) + '%',
-        textposition='outside',
-        marker_color='#2ca02c'
-    ))
-    
-    fig.update_layout(
-        title="Distribución Porcentual por Aliado",
-        yaxis_title="Porcentaje (%)",
-        xaxis_title="",
-        plot_bgcolor='rgba(0,0,0,0)',
-        paper_bgcolor='rgba(0,0,0,0)',
-        font=dict(color='white'),
-        margin=dict(l=20, r=20, b=100, t=50),
-        yaxis=dict(range=[0, 100]),
+FIG_PORCENTAJE = {
+    'data': [{
+        'type': 'bar',
+        'textposition': 'outside',
+        'marker': {'color': '#2ca02c'}
+    }],
+    'layout': dict(
+        LAYOUT_BASE,
+        title={'text': "Distribución Porcentual por Aliado"},
+        xaxis={'title': {'text': ""}},
+        yaxis={'title': {'text': "Porcentaje (%)"}, 'range': [0, 100]},
+        margin={'l': 20, 'r': 20, 'b': 100, 't': 50},
         height=500
     )
+}
+
+def crear_figura(plantilla, **datos):
+    # Copiar solo la traza; el layout se comparte porque nunca se modifica
+    return {'data': [dict(plantilla['data'][0], **datos)], 'layout': plantilla['layout']}
+
+def crear_grafico_barras(ciudades, sumas):
+    return crear_figura(FIG_BARRAS, x=sumas, y=ciudades, text=sumas)
+
+def crear_grafico_lineas(aliados, sumas):
+    return crear_figura(FIG_LINEAS, x=aliados, y=sumas)
+
+def crear_grafico_porcentaje(aliados, sumas):
+    total = sumas.sum()
+    porcentaje = (sumas / total * 100) if total > 0 else np.zeros(len(sumas))
     
-    return fig
+    return crear_figura(
+        FIG_PORCENTAJE,
+        x=aliados,
+        y=porcentaje,
+        text=[f"{p:.1f}%" for p in porcentaje]
+    )
 
 # =============================================
 # Configuración para producción